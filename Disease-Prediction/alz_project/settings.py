@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'prediction.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'alz_project.urls'
@@ -107,6 +108,32 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]  # if you have a static folder
 
+# Similar-case retrieval: memory-mapped scan embeddings. `manage.py
+# backfill_embeddings` builds the index offline, and trains the approximate
+# (IVF) partition once the store reaches this many vectors
+EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'embeddings')
+SIMILARITY_APPROXIMATE_MIN_VECTORS = 100000
+
+# Request profiling: which paths/users get profiled is controlled at runtime
+# by ProfilingRule rows in the admin; set False to drop the middleware entirely
+PROFILING_ENABLED = True
+PROFILING_RULES_TTL = 30  # seconds a worker caches the rule list
+PROFILING_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+
+# Retention: `manage.py archive_scans` moves scans older than RETENTION_DAYS
+# into ArchivedPrediction and packs their images into zip shards here
+ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+RETENTION_DAYS = 365
+RETENTION_BATCH_SIZE = 500
+
+# Model inference: 'local' loads TensorFlow in every worker; 'sidecar' sends
+# batches to a single `manage.py inference_server` process over a Unix socket
+INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'local')
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET', '/tmp/oncoderma-inference.sock')
+INFERENCE_MAX_BATCH = 32
+INFERENCE_MAX_WAIT_MS = 5
+INFERENCE_TIMEOUT = 30  # seconds
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
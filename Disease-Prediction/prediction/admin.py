@@ -1,18 +1,169 @@
-from django.contrib import admin
-from .models import Prediction, UserProfile
+from collections import Counter
+
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import ArchivedPrediction, Prediction, ProfilingRule, RequestProfile, UserProfile
+
+# --------------------------
+# LARGE-TABLE HELPERS
+# --------------------------
+
+# Below this many rows an exact COUNT(*) is cheap enough to keep
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def estimated_row_count(model, using="default"):
+    """Planner/statistics row estimate for ``model``'s table, or None."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == "sqlite":
+            # Separate subqueries so each MIN/MAX is a single primary key seek
+            cursor.execute(f'SELECT (SELECT MAX("id") FROM "{table}") - (SELECT MIN("id") FROM "{table}") + 1')
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses a statistics estimate for the unfiltered changelist count."""
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimated_row_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate > EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class CachedAllValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """AllValuesFieldListFilter whose DISTINCT lookup is cached for a few minutes."""
+
+    cache_timeout = 300
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        key = f"admin-filter-values:{model._meta.label_lower}:{field_path}"
+        choices = cache.get(key)
+        if choices is None:
+            choices = list(self.lookup_choices)
+            cache.set(key, choices, self.cache_timeout)
+        self.lookup_choices = choices
+
 
 # Register your models here.
 
 @admin.register(Prediction)
 class PredictionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'patient_name', 'scan_type', 'result', 'confidence', 'risk_level', 'timestamp', 'image_file')
-    list_filter = ('scan_type', 'result', 'risk_level', 'timestamp')
-    search_fields = ('patient_name', 'result', 'scan_type')
+    list_display = ('id', 'thumbnail_preview', 'patient_name', 'scan_type', 'result', 'confidence', 'risk_level', 'timestamp')
+    list_filter = (
+        ('scan_type', CachedAllValuesFieldListFilter),
+        ('result', CachedAllValuesFieldListFilter),
+        ('risk_level', CachedAllValuesFieldListFilter),
+        # Range lookups on the indexed column; date_hierarchy would run a
+        # DISTINCT over every row to list the years
+        'timestamp',
+    )
+    search_fields = ('patient_name',)
+    search_help_text = "Scan id, or the start of the patient name (case-sensitive)."
     ordering = ('-timestamp',)
     readonly_fields = ('timestamp',)
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact id or an index range scan on patient_name, instead of
+        # LIKE '%q%' over three unindexed columns
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return queryset.filter(patient_name__gte=search_term, patient_name__lt=search_term + "\uffff"), False
+
+    @admin.display(description="Image")
+    def thumbnail_preview(self, obj):
+        # Only the stored name is used: no storage calls or image work per row.
+        # (Not named "thumbnail": the admin would resolve the model field first)
+        if not obj.thumbnail:
+            return "-"
+        return format_html('<img src="{}" width="48" height="48" style="object-fit: cover;" loading="lazy">', obj.thumbnail.url)
+
+@admin.register(ArchivedPrediction)
+class ArchivedPredictionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'patient_name', 'scan_type', 'result', 'risk_level', 'timestamp', 'shard', 'archived_at')
+    list_filter = ('timestamp', 'archived_at')
+    search_fields = ('=id',)
+    ordering = ('-timestamp',)
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'phone', 'institution', 'email_notifications', 'research_participation')
-    list_filter = ('institution', 'email_notifications', 'research_participation')
+    list_filter = (('institution', CachedAllValuesFieldListFilter), 'email_notifications', 'research_participation')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email', 'phone', 'institution')
+    raw_id_fields = ('user',)
+
+
+@admin.register(ProfilingRule)
+class ProfilingRuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'path_prefix', 'user', 'sample_rate', 'mode', 'enabled', 'created')
+    list_editable = ('sample_rate', 'mode', 'enabled')
+    list_filter = ('enabled', 'mode')
+    raw_id_fields = ('user',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'method', 'path', 'view_name', 'user', 'status_code', 'mode', 'duration_ms', 'created')
+    list_filter = ('mode', 'view_name')
+    search_fields = ('path',)
+    ordering = ('-created',)
+    date_hierarchy = 'created'
+    list_select_related = ('user',)
+    readonly_fields = [f.name for f in RequestProfile._meta.fields]
+    actions = ['download_folded_stacks']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Download merged sampled stacks (flamegraph.pl / speedscope)")
+    def download_folded_stacks(self, request, queryset):
+        # Sample counts from different requests add up; cProfile timings are
+        # in other units and have no full stacks, so they are never merged in
+        other = queryset.exclude(mode='sample').count()
+        if other:
+            self.message_user(
+                request,
+                f"{other} of the selected profiles are not stack-sampling profiles. Select only "
+                f"'Stack sampling' profiles to download folded stacks; cProfile results are in each profile's stats.",
+                messages.ERROR,
+            )
+            return None
+
+        counts = Counter()
+        for folded in queryset.values_list('folded_stacks', flat=True):
+            for line in folded.splitlines():
+                stack, _, count = line.rpartition(' ')
+                if stack:
+                    counts[stack] += int(count)
+        body = "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+        response = HttpResponse(body, content_type='text/plain')
+        response['Content-Disposition'] = 'attachment; filename="sampled-stacks.folded"'
+        return response
@@ -0,0 +1,389 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single-process runserver only
+    fcntl = None
+
+import numpy as np
+from django.conf import settings
+
+# --------------------------
+# EMBEDDING STORE
+# --------------------------
+# Penultimate-layer embeddings are kept outside the database as two
+# append-only files: a float16 matrix (one L2-normalised row per scan) and a
+# parallel int64 array of Prediction ids. Both are memory-mapped on read, so
+# the index costs page cache rather than Python heap.
+#
+# The id sort order and the IVF partition are built offline (see
+# build_index / `manage.py backfill_embeddings`) and saved next to the
+# matrix. Rows appended after that build form a short "tail" which requests
+# handle with linear scans, so no request ever sorts ids or trains k-means.
+
+VECTORS_FILE = "vectors.f16"
+IDS_FILE = "ids.i64"
+META_FILE = "meta.json"
+LOCK_FILE = "write.lock"
+INDEX_FILE = "index.npz"
+
+# Rows scored per matmul when scanning the matrix, bounds the float32 scratch
+SEARCH_CHUNK_ROWS = 65536
+
+_write_lock = threading.Lock()
+
+
+def embeddings_dir():
+    return getattr(settings, "EMBEDDINGS_DIR", os.path.join(settings.BASE_DIR, "embeddings"))
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped float16 embedding matrix keyed by Prediction.id."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or embeddings_dir()
+        self.vectors_path = os.path.join(self.directory, VECTORS_FILE)
+        self.ids_path = os.path.join(self.directory, IDS_FILE)
+        self.meta_path = os.path.join(self.directory, META_FILE)
+        self.lock_path = os.path.join(self.directory, LOCK_FILE)
+        self.index_path = os.path.join(self.directory, INDEX_FILE)
+
+    @contextmanager
+    def _locked(self):
+        # Worker processes append concurrently; the thread lock alone would
+        # let two processes interleave their vector and id writes
+        with _write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def dim(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)["dim"]
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        # Only rows whose id and vector are both fully written count
+        dim = self.dim
+        try:
+            id_rows = os.path.getsize(self.ids_path) // 8
+            vector_rows = os.path.getsize(self.vectors_path) // (2 * dim) if dim else 0
+        except FileNotFoundError:
+            return 0
+        return min(id_rows, vector_rows)
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        vectors = _normalise(np.asarray(vectors).reshape(len(ids), -1)).astype(np.float16)
+
+        with self._locked():
+            dim = self.dim
+            if dim is None:
+                with open(self.meta_path, "w") as f:
+                    json.dump({"dim": int(vectors.shape[1])}, f)
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {dim}")
+
+            # Vectors first: a reader never sees an id without its row.
+            # A crash between the two writes is truncated back on the next add
+            self._truncate_to_complete_rows(dim or vectors.shape[1])
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(ids.tobytes())
+
+    def _truncate_to_complete_rows(self, dim):
+        if not os.path.exists(self.ids_path) or not os.path.exists(self.vectors_path):
+            return
+        rows = len(self)
+        for path, row_bytes in ((self.ids_path, 8), (self.vectors_path, 2 * dim)):
+            if os.path.getsize(path) != rows * row_bytes:
+                os.truncate(path, rows * row_bytes)
+
+    def clear(self):
+        with self._locked():
+            for path in (self.vectors_path, self.ids_path, self.meta_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def load(self):
+        """Return ``(ids, vectors)``, both memory-mapped read-only."""
+        dim = self.dim
+        count = len(self)
+        if dim is None or count == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, dim or 0), dtype=np.float16)
+
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(count,))
+        vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(count, dim))
+        return ids, vectors
+
+    def existing_ids(self):
+        count = len(self)
+        if not count:
+            return set()
+        return set(np.fromfile(self.ids_path, dtype=np.int64, count=count).tolist())
+
+    def write_index(self, index):
+        """Persist ``index``'s id order and IVF partition for request-time loading."""
+        arrays = {"sorted": index._sorted}
+        if index.ivf is not None:
+            arrays.update(
+                centroids=index.ivf["centroids"],
+                list_rows=index.ivf["rows"],
+                list_offsets=index.ivf["offsets"],
+            )
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        # Readers only ever see a complete artifact
+        os.replace(tmp, self.index_path)
+
+    def read_index(self):
+        """Return ``(sorted_rows, ivf)`` from the saved artifact, or ``(None, None)``."""
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                sorted_rows = data["sorted"]
+                ivf = None
+                if "centroids" in data:
+                    ivf = {
+                        "centroids": data["centroids"],
+                        "rows": data["list_rows"],
+                        "offsets": data["list_offsets"],
+                        "size": len(sorted_rows),
+                    }
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, None
+        return sorted_rows, ivf
+
+
+# --------------------------
+# NEAREST-NEIGHBOUR INDEX
+# --------------------------
+
+class SimilarityIndex:
+    """Cosine-similarity search over an embedding matrix.
+
+    Exact mode scores every row with a chunked matmul. Approximate mode builds
+    a coarse inverted-file (IVF) partition with spherical k-means and only
+    scores the ``n_probe`` lists closest to the query.
+
+    ``sorted_rows`` and ``ivf`` come from a saved artifact covering the first
+    ``len(sorted_rows)`` rows; later rows are the unsorted tail. Without them
+    the whole matrix is sorted (and partitioned) here, which is the offline
+    build path.
+    """
+
+    def __init__(self, ids, vectors, approximate=False, n_lists=None, n_probe=8, seed=0, ivf=None, sorted_rows=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = vectors
+        if sorted_rows is None:
+            sorted_rows = np.argsort(self.ids, kind="stable")
+        self._sorted = sorted_rows
+        self._indexed = len(sorted_rows)
+
+        self.approximate = approximate and len(self.ids) > 0
+        self.n_probe = n_probe
+        self.ivf = None
+        if self.approximate:
+            self.ivf = ivf or self._build_ivf(n_lists or max(1, int(np.sqrt(len(self.ids)))), seed)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _build_ivf(self, n_lists, seed, iterations=10, sample_size=50000):
+        rng = np.random.default_rng(seed)
+        n = len(self.ids)
+        n_lists = min(n_lists, n)
+
+        sample = self.vectors[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalise(sums)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SEARCH_CHUNK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        list_rows = np.argsort(assign, kind="stable")
+        list_offsets = np.searchsorted(assign[list_rows], np.arange(n_lists + 1))
+        return {"centroids": centroids, "rows": list_rows, "offsets": list_offsets, "size": n}
+
+    def rows_for(self, prediction_ids):
+        """Map ids to matrix rows, newest row per id; unknown ids are dropped."""
+        wanted = np.unique(np.asarray(prediction_ids, dtype=np.int64))
+        if not len(wanted) or not len(self.ids):
+            return np.empty(0, dtype=np.int64)
+
+        # Rows are append-ordered, so the last match is the newest embedding
+        # and a tail row always wins over an indexed one
+        tail = np.asarray(self.ids[self._indexed:])
+        hits = np.flatnonzero(np.isin(tail, wanted))[::-1]
+        tail_ids, first = np.unique(tail[hits], return_index=True)
+        tail_rows = self._indexed + hits[first]
+
+        wanted = np.setdiff1d(wanted, tail_ids, assume_unique=True)
+        rows = np.empty(0, dtype=np.int64)
+        if len(wanted) and self._indexed:
+            indexed_ids = self.ids[:self._indexed]
+            pos = np.searchsorted(indexed_ids, wanted, side="right", sorter=self._sorted) - 1
+            found = pos >= 0
+            rows = self._sorted[pos[found]]
+            rows = rows[indexed_ids[rows] == wanted[found]]
+        return np.concatenate([rows, tail_rows])
+
+    def vector_for(self, prediction_id):
+        rows = self.rows_for([prediction_id])
+        if not len(rows):
+            return None
+        return np.asarray(self.vectors[rows[0]], dtype=np.float32)
+
+    def _candidate_rows(self, query):
+        if not self.approximate:
+            return None
+        ivf = self.ivf
+        probe = np.argsort(ivf["centroids"] @ query)[::-1][:self.n_probe]
+        rows = [ivf["rows"][ivf["offsets"][c]:ivf["offsets"][c + 1]] for c in probe]
+        # Rows appended since the partition was built are always scanned
+        rows.append(np.arange(ivf["size"], len(self.ids)))
+        return np.sort(np.concatenate(rows))
+
+    def search(self, query, k=5, allowed_ids=None, exclude_ids=()):
+        """Return up to ``k`` ``(prediction_id, score)`` pairs, best first.
+
+        With ``allowed_ids`` only those rows are scored, exactly, whatever
+        the mode: probing IVF lists first would miss most of a small set.
+        """
+        if not len(self.ids):
+            return []
+        query = _normalise(query).reshape(-1)
+        excluded = np.fromiter(exclude_ids, dtype=np.int64)
+
+        if allowed_ids is not None:
+            allowed = np.setdiff1d(np.fromiter(allowed_ids, dtype=np.int64), excluded)
+            rows = np.sort(self.rows_for(allowed))
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            top = np.argsort(scores)[::-1][:k]
+            return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+        rows = self._candidate_rows(query)
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        total = len(self.ids) if rows is None else len(rows)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            if rows is None:
+                block_ids = self.ids[start:start + SEARCH_CHUNK_ROWS]
+                block = self.vectors[start:start + SEARCH_CHUNK_ROWS]
+            else:
+                block_rows = rows[start:start + SEARCH_CHUNK_ROWS]
+                block_ids = self.ids[block_rows]
+                block = self.vectors[block_rows]
+
+            scores = np.asarray(block, dtype=np.float32) @ query
+            if len(excluded):
+                scores = np.where(np.isin(block_ids, excluded), -np.inf, scores)
+
+            # Over-fetch so a re-embedded scan cannot crowd out the top k
+            fetch = 2 * k
+            if len(scores) > fetch:
+                top = np.argpartition(scores, -fetch)[-fetch:]
+            else:
+                top = np.arange(len(scores))
+            best_ids = np.concatenate([best_ids, block_ids[top]])
+            best_scores = np.concatenate([best_scores, scores[top]])
+
+        results = []
+        for i in np.argsort(best_scores)[::-1]:
+            if len(results) == k or not np.isfinite(best_scores[i]):
+                break
+            if all(best_ids[i] != found for found, _ in results):
+                results.append((int(best_ids[i]), float(best_scores[i])))
+        return results
+
+
+# --------------------------
+# PROCESS-WIDE INDEX CACHE
+# --------------------------
+
+_index = None
+
+_index_key = None
+_artifact = (None, None, None)
+_index_lock = threading.Lock()
+
+
+def build_index(store=None, approximate=None):
+    """Sort the ids (and train the IVF partition past the threshold) and save them for get_index."""
+    store = store or EmbeddingStore()
+    ids, vectors = store.load()
+    if approximate is None:
+        approximate = len(ids) >= getattr(settings, "SIMILARITY_APPROXIMATE_MIN_VECTORS", 100000)
+    index = SimilarityIndex(ids, vectors, approximate=approximate)
+    store.write_index(index)
+    return index
+
+
+def _index_mtime(store):
+    try:
+        return os.stat(store.index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_index():
+    """Return the cached index, remapping the store when it has grown.
+
+    Only memory maps and the saved artifact are (re)opened here; rows added
+    since the last build_index are served from the tail until the next one.
+    """
+    global _index, _index_key, _artifact
+    store = EmbeddingStore()
+    size = len(store)
+    mtime = _index_mtime(store)
+    key = (store.directory, size, mtime)
+    with _index_lock:
+        if _index is None or key != _index_key:
+            if _artifact[0] != (store.directory, mtime):
+                _artifact = ((store.directory, mtime), *store.read_index())
+            _, sorted_rows, ivf = _artifact
+            if sorted_rows is None or len(sorted_rows) > size:
+                # No build yet, or a stale one from before a rebuild
+                sorted_rows, ivf = np.empty(0, dtype=np.int64), None
+            ids, vectors = store.load()
+            _index = SimilarityIndex(ids, vectors, approximate=ivf is not None, ivf=ivf, sorted_rows=sorted_rows)
+            _index_key = key
+        return _index
+
+
+def similar_prediction_ids(prediction_id, allowed_ids=None, k=5):
+    index = get_index()
+    query = index.vector_for(prediction_id)
+    if query is None:
+        return []
+    return index.search(query, k=k, allowed_ids=allowed_ids, exclude_ids=[prediction_id])
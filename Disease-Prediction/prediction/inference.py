@@ -0,0 +1,289 @@
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+# --------------------------
+# MODEL INFERENCE
+# --------------------------
+# Two modes, chosen by settings.INFERENCE_MODE:
+#   "local"   - every Django worker loads TensorFlow and the model itself.
+#   "sidecar" - one `manage.py inference_server` process owns the model and
+#               workers send it image batches over a Unix socket. Workers
+#               never import TensorFlow, so its runtime (far larger than the
+#               1.6 MB of weights) is paid once per node instead of per worker.
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skin_cancer_model.h5")
+INPUT_SIZE = (28, 28)
+
+
+class InferenceUnavailable(Exception):
+    """No model could serve the request (failed load, sidecar down, ...)."""
+
+
+def preprocess_image(fp):
+    # Equivalent to keras image.load_img(fp, target_size=(28, 28)) followed
+    # by img_to_array, without importing TensorFlow in the web worker
+    img = Image.open(fp)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img = img.resize(INPUT_SIZE, Image.NEAREST)
+    img_array = np.asarray(img, dtype=np.float32)
+    # img_array = img_array / 255.0  # Rescale to [0, 1] as done in training
+    return img_array
+
+
+class LocalModel:
+    """The Keras model plus a two-output view exposing the penultimate layer."""
+
+    def __init__(self, path=MODEL_PATH):
+        from tensorflow.keras.models import Model, load_model
+
+        self.model = load_model(path)
+        # Same forward pass, but also exposing the penultimate layer as an
+        # embedding for similar-case retrieval
+        self.feature_model = None
+        try:
+            self.feature_model = Model(inputs=self.model.inputs, outputs=[self.model.layers[-2].output, self.model.output])
+        except Exception as e:
+            print(f"Error building feature model: {e}")
+
+    def predict(self, img_batch):
+        """Return ``(predictions, embeddings)``; embeddings is None without a feature model."""
+        if self.feature_model is not None:
+            embeddings, predictions = self.feature_model.predict(img_batch, verbose=0)
+            return predictions, embeddings.reshape(len(img_batch), -1)
+        return self.model.predict(img_batch, verbose=0), None
+
+
+_local_model = None
+_local_model_error = None
+_local_lock = threading.Lock()
+
+
+def get_local_model():
+    global _local_model, _local_model_error
+    with _local_lock:
+        if _local_model is None and _local_model_error is None:
+            try:
+                _local_model = LocalModel()
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                _local_model_error = e
+    if _local_model is None:
+        raise InferenceUnavailable(f"Model not loaded: {_local_model_error}")
+    return _local_model
+
+
+def inference_mode():
+    return getattr(settings, "INFERENCE_MODE", "local")
+
+
+def warm_up():
+    """Load the in-process model at startup in local mode; a no-op for the sidecar."""
+    if inference_mode() == "local":
+        try:
+            get_local_model()
+        except InferenceUnavailable:
+            pass
+
+
+def run_model(img_batch):
+    """Return ``(predictions, embeddings)`` for a batch of preprocessed images."""
+    img_batch = np.asarray(img_batch, dtype=np.float32)
+    if inference_mode() == "sidecar":
+        return SidecarClient().predict(img_batch)
+    return get_local_model().predict(img_batch)
+
+
+# --------------------------
+# SIDECAR WIRE FORMAT
+# --------------------------
+# Every message is a 4-byte big-endian length followed by an .npy/.npz
+# payload (loaded with allow_pickle=False). Requests carry one image batch,
+# responses an .npz with "predictions" and optionally "embeddings", or
+# "error" when the server could not run the batch.
+
+_HEADER = struct.Struct(">I")
+
+
+def _send(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Socket closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock):
+    header = sock.recv(_HEADER.size, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise ConnectionError("Socket closed mid-header")
+    return _recv_exact(sock, _HEADER.unpack(header)[0])
+
+
+def _dumps(**arrays):
+    out = BytesIO()
+    np.savez(out, **arrays)
+    return out.getvalue()
+
+
+class SidecarClient:
+    def __init__(self, socket_path=None, timeout=None):
+        self.socket_path = socket_path or getattr(settings, "INFERENCE_SOCKET", "/tmp/oncoderma-inference.sock")
+        self.timeout = timeout or getattr(settings, "INFERENCE_TIMEOUT", 30)
+
+    def predict(self, img_batch):
+        out = BytesIO()
+        np.save(out, np.ascontiguousarray(img_batch, dtype=np.float32))
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                # Connect before setting a timeout: a non-blocking AF_UNIX
+                # connect fails with EAGAIN instead of waiting for the backlog
+                sock.connect(self.socket_path)
+                sock.settimeout(self.timeout)
+                _send(sock, out.getvalue())
+                payload = _recv(sock)
+        except OSError as e:
+            raise InferenceUnavailable(f"Inference sidecar unreachable at {self.socket_path}: {e}") from e
+        if payload is None:
+            raise InferenceUnavailable("Inference sidecar closed the connection")
+
+        with np.load(BytesIO(payload), allow_pickle=False) as data:
+            if "error" in data:
+                raise InferenceUnavailable(str(data["error"]))
+            embeddings = data["embeddings"] if "embeddings" in data else None
+            return data["predictions"], embeddings
+
+
+# --------------------------
+# SIDECAR SERVER
+# --------------------------
+
+class _Job:
+    __slots__ = ("batch", "done", "predictions", "embeddings", "error")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.done = threading.Event()
+        self.predictions = self.embeddings = self.error = None
+
+
+class BatchingPredictor:
+    """Coalesces concurrent requests into one model call.
+
+    The first queued job opens a window of ``max_wait`` seconds; jobs that
+    arrive within it are run together, up to ``max_batch`` images.
+    """
+
+    def __init__(self, model, max_batch=32, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, batch):
+        job = _Job(batch)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.predictions, job.embeddings
+
+    def _collect(self):
+        jobs = [self._queue.get()]
+        size = len(jobs[0].batch)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.batch)
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            try:
+                predictions, embeddings = self.model.predict(np.concatenate([job.batch for job in jobs]))
+                start = 0
+                for job in jobs:
+                    end = start + len(job.batch)
+                    job.predictions = predictions[start:end]
+                    job.embeddings = None if embeddings is None else embeddings[start:end]
+                    start = end
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            for job in jobs:
+                job.done.set()
+
+
+def _check_batch(batch):
+    # Rejected per request: one bad batch must not fail the others it would
+    # have been concatenated with
+    expected = (*INPUT_SIZE, 3)
+    if not isinstance(batch, np.ndarray):
+        raise ValueError("Request must be a single .npy array")
+    if batch.dtype != np.float32:
+        raise ValueError(f"Expected float32 images, got {batch.dtype}")
+    if batch.ndim != 4 or batch.shape[1:] != expected or not len(batch):
+        raise ValueError(f"Expected a (n, {', '.join(map(str, expected))}) image batch, got {batch.shape}")
+
+
+class _SidecarHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # Connections may be reused for several requests
+        while True:
+            try:
+                payload = _recv(self.request)
+            except ConnectionError:
+                return
+            if payload is None:
+                return
+            try:
+                batch = np.load(BytesIO(payload), allow_pickle=False)
+                _check_batch(batch)
+                predictions, embeddings = self.server.predictor.submit(batch)
+                arrays = {"predictions": predictions}
+                if embeddings is not None:
+                    arrays["embeddings"] = embeddings
+                response = _dumps(**arrays)
+            except Exception as e:
+                response = _dumps(error=np.array(f"{type(e).__name__}: {e}"))
+            _send(self.request, response)
+
+
+class SidecarServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, socket_path, predictor):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.predictor = predictor
+        super().__init__(socket_path, _SidecarHandler)
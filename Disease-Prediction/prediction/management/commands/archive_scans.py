@@ -0,0 +1,63 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from prediction.retention import archive_old_scans
+
+
+def _size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+class Command(BaseCommand):
+    help = "Move scans older than the retention age into the archive table and zip shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=None,
+                            help="Defaults to settings.RETENTION_DAYS.")
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "RETENTION_BATCH_SIZE", 500))
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived.")
+        parser.add_argument("--vacuum", action="store_true",
+                            help="Run VACUUM afterwards so SQLite returns the freed pages to the filesystem.")
+
+    def handle(self, *args, **options):
+        db_path = settings.DATABASES["default"]["NAME"] if connection.vendor == "sqlite" else None
+        db_size_before = os.path.getsize(db_path) if db_path and os.path.exists(db_path) else None
+
+        report = archive_old_scans(
+            older_than_days=options["older_than_days"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            log=self.stdout.write,
+        )
+
+        self.stdout.write(f"Cutoff: {report['cutoff']:%Y-%m-%d %H:%M}")
+        self.stdout.write(f"Scans eligible: {report['candidates']} of {report['hot_rows_before']}")
+        if options["dry_run"]:
+            return
+
+        if options["vacuum"]:
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+
+        self.stdout.write(f"Scans archived: {report['archived']}")
+        self.stdout.write(f"Media freed: {_size(report['media_bytes_freed'])}")
+        self.stdout.write(f"Archive shards written: {_size(report['shard_bytes_written'])}")
+        self.stdout.write(
+            f"Reclaimed: {_size(report['media_bytes_freed'] - report['shard_bytes_written'])} net"
+        )
+        if db_size_before is not None:
+            self.stdout.write(
+                f"Database file: {_size(db_size_before)} -> {_size(os.path.getsize(db_path))}"
+                + ("" if options["vacuum"] else " (run with --vacuum to shrink)")
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Hot table: {report['hot_rows_before']} -> {report['hot_rows_after']} rows, "
+            f"dashboard queries {report['hot_query_ms_before']:.1f} ms -> {report['hot_query_ms_after']:.1f} ms"
+        ))
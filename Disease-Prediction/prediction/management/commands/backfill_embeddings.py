@@ -0,0 +1,81 @@
+import time
+from io import BytesIO
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from prediction.embeddings import EmbeddingStore, build_index
+from prediction.inference import InferenceUnavailable, preprocess_image, run_model
+from prediction.models import Prediction
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute penultimate-layer embeddings for Prediction rows that do not have one yet, "
+        "then rebuild the similarity index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Discard the existing embedding store and re-embed every scan.",
+        )
+        parser.add_argument(
+            "--index-only",
+            action="store_true",
+            help="Skip embedding and only rebuild the index over rows already in the store.",
+        )
+
+    def handle(self, *args, **options):
+        store = EmbeddingStore()
+        if options["index_only"]:
+            self.build_index(store)
+            return
+        if options["rebuild"]:
+            store.clear()
+
+        done = store.existing_ids()
+        batch_ids, batch_images = [], []
+        added = skipped = 0
+
+        def flush():
+            nonlocal added
+            if batch_ids:
+                try:
+                    _, embeddings = run_model(np.stack(batch_images))
+                except InferenceUnavailable as e:
+                    raise CommandError(str(e))
+                if embeddings is None:
+                    raise CommandError("Feature model not loaded properly.")
+                store.add(batch_ids, embeddings)
+                added += len(batch_ids)
+                batch_ids.clear()
+                batch_images.clear()
+
+        for scan in Prediction.objects.order_by("id").only("id", "image_file").iterator():
+            if scan.id in done:
+                continue
+            try:
+                with scan.image_file.open("rb") as f:
+                    batch_images.append(preprocess_image(BytesIO(f.read())))
+            except Exception as e:
+                self.stderr.write(f"Skipping scan {scan.id}: {e}")
+                skipped += 1
+                continue
+            batch_ids.append(scan.id)
+            if len(batch_ids) >= options["batch_size"]:
+                flush()
+        flush()
+
+        self.stdout.write(self.style.SUCCESS(f"Embedded {added} scans ({skipped} skipped, {len(store)} in store)."))
+        self.build_index(store)
+
+    def build_index(self, store):
+        started = time.perf_counter()
+        index = build_index(store)
+        mode = "IVF" if index.ivf is not None else "exact"
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} vectors ({mode}) in {time.perf_counter() - started:.1f}s."
+        ))
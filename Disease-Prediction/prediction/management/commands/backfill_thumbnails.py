@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from prediction.models import Prediction
+from prediction.thumbnails import make_thumbnail
+
+
+class Command(BaseCommand):
+    help = "Create admin thumbnails for scans saved before thumbnails were generated at upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Also retry scans whose image previously failed to decode.",
+        )
+
+    def handle(self, *args, **options):
+        scans = Prediction.objects.filter(thumbnail="")
+        if not options["retry_failed"]:
+            scans = scans.filter(thumbnail_failed=False)
+
+        made = failed = 0
+        for scan in scans.order_by("id").only("id", "image_file", "thumbnail", "thumbnail_failed").iterator():
+            if make_thumbnail(scan):
+                made += 1
+            else:
+                failed += 1
+            if (made + failed) % 1000 == 0:
+                self.stdout.write(f"Processed {made + failed} scans", ending="\r")
+
+        self.stdout.write(self.style.SUCCESS(f"Created {made} thumbnails ({failed} failed)."))
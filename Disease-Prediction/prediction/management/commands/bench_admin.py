@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.utils import timezone
+
+from prediction.admin import PredictionAdmin
+from prediction.models import Prediction
+
+BENCH_USERNAME = "bench-admin"
+
+RESULTS = [
+    ('Melanocytic nevi (nv)', 'Low Risk (benign)'),
+    ('Melanoma (mel)', 'Very High Risk (life-threatening malignant tumor)'),
+    ('Benign keratosis-like lesions (bkl)', 'Low Risk'),
+    ('Basal cell carcinoma (bcc)', 'High Risk (malignant but slow growing)'),
+    ('Actinic keratoses (akiec)', 'Moderate Risk (pre-cancerous lesion)'),
+    ('Vascular lesions (vasc)', 'Low Risk (benign)'),
+    ('Dermatofibroma (df)', 'Low Risk (benign)'),
+]
+
+
+class LegacyPredictionAdmin(admin.ModelAdmin):
+    """The PredictionAdmin options before the large-table rework, for comparison."""
+
+    list_display = ('id', 'patient_name', 'scan_type', 'result', 'confidence', 'risk_level', 'timestamp', 'image_file')
+    list_filter = ('scan_type', 'result', 'risk_level', 'timestamp')
+    search_fields = ('patient_name', 'result', 'scan_type')
+    ordering = ('-timestamp',)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the Prediction admin changelist queries on a large synthetic table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic rows afterwards.")
+
+    def handle(self, *args, **options):
+        user, created = User.objects.get_or_create(username=BENCH_USERNAME, defaults={"is_superuser": True, "is_staff": True})
+        existing = Prediction.objects.filter(user=user).count()
+        if existing < options["rows"]:
+            self.populate(user, options["rows"] - existing)
+
+        factory = RequestFactory()
+        midnight = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        scenarios = [
+            ("first page", {}),
+            ("deep page", {"p": str(max(1, options["rows"] // 200))}),
+            ("filter result", {"result": RESULTS[1][0]}),
+            ("past 7 days", {
+                "timestamp__gte": str(midnight - timedelta(days=7)),
+                "timestamp__lt": str(midnight + timedelta(days=1)),
+            }),
+            ("search patient", {"q": "patient-4242"}),
+        ]
+        admins = [
+            ("legacy", LegacyPredictionAdmin(Prediction, admin.site)),
+            ("current", PredictionAdmin(Prediction, admin.site)),
+        ]
+
+        self.stdout.write(f"{'scenario':<16} {'legacy ms':>10} {'current ms':>11}")
+        for label, params in scenarios:
+            timings = {}
+            for name, model_admin in admins:
+                runs = []
+                for _ in range(options["repeat"]):
+                    request = factory.get("/admin/prediction/prediction/", params)
+                    request.user = user
+                    started = time.perf_counter()
+                    self.render_changelist(model_admin, request)
+                    runs.append((time.perf_counter() - started) * 1000)
+                timings[name] = statistics.median(runs)
+            self.stdout.write(f"{label:<16} {timings['legacy']:>10.1f} {timings['current']:>11.1f}")
+
+        if not options["keep"]:
+            Prediction.objects.filter(user=user).delete()
+            if created:
+                user.delete()
+            cache.clear()
+
+    def render_changelist(self, model_admin, request):
+        # The full admin view and template, so list_display columns (the
+        # thumbnail included) are rendered for every row on the page
+        response = model_admin.changelist_view(request)
+        response.render()
+        if response.status_code != 200:
+            raise CommandError(f"{type(model_admin).__name__} changelist returned {response.status_code}")
+
+    def populate(self, user, count, batch_size=10000):
+        now = timezone.now()
+        rng = random.Random(0)
+        timestamp = Prediction._meta.get_field("timestamp")
+        # Spread scans over three years instead of stamping them all "now"
+        timestamp.auto_now_add = False
+        try:
+            for start in range(0, count, batch_size):
+                rows = []
+                for i in range(start, min(count, start + batch_size)):
+                    result, risk = rng.choice(RESULTS)
+                    rows.append(Prediction(
+                        user=user,
+                        patient_name=f"patient-{i}",
+                        scan_type=rng.choice(["Dermoscopy", "Clinical", "Close-up"]),
+                        result=result,
+                        confidence=rng.uniform(40, 100),
+                        risk_level=risk,
+                        timestamp=now - timedelta(seconds=rng.randrange(3 * 365 * 86400)),
+                        image_file="uploads/bench.jpg",
+                        thumbnail="thumbnails/bench.jpg",
+                    ))
+                Prediction.objects.bulk_create(rows)
+                self.stdout.write(f"Inserted {min(count, start + batch_size)}/{count}", ending="\r")
+        finally:
+            timestamp.auto_now_add = True
+        self.stdout.write("")
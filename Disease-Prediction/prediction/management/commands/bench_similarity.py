@@ -0,0 +1,83 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from prediction.embeddings import EmbeddingStore, SimilarityIndex
+
+
+class Command(BaseCommand):
+    help = "Benchmark similar-scan query latency on synthetic embedding stores."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+        parser.add_argument("--dim", type=int, default=128)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--n-probe", type=int, default=8)
+        parser.add_argument("--user-scans", type=int, default=100,
+                            help="Size of the allowed_ids set for the per-user path scan_detail_view uses.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        dim, k = options["dim"], options["k"]
+
+        self.stdout.write(f"{'vectors':>10} {'mode':>12} {'build ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+        for size in options["sizes"]:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = EmbeddingStore(tmp)
+                # Clustered data: uniform random vectors have no neighbours worth finding
+                centres = rng.standard_normal((max(1, size // 100), dim)).astype(np.float32)
+                for start in range(0, size, 100000):
+                    n = min(100000, size - start)
+                    vectors = centres[rng.integers(len(centres), size=n)]
+                    vectors += 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+                    store.add(np.arange(start, start + n), vectors)
+
+                ids, vectors = store.load()
+                queries = rng.choice(size, size=options["queries"], replace=False)
+                # One "user" per query: the query scan plus other random scans
+                users = [
+                    np.union1d([q], rng.choice(size, size=min(size, options["user_scans"]), replace=False))
+                    for q in queries
+                ]
+                exact_results = None
+
+                for approximate in (False, True):
+                    started = time.perf_counter()
+                    index = SimilarityIndex(ids, vectors, approximate=approximate, n_probe=options["n_probe"])
+                    build_ms = (time.perf_counter() - started) * 1000
+
+                    timings, results = [], []
+                    for q in queries:
+                        started = time.perf_counter()
+                        results.append(index.search(index.vector_for(q), k=k, exclude_ids=[q]))
+                        timings.append((time.perf_counter() - started) * 1000)
+
+                    if exact_results is None:
+                        exact_results = results
+                    self.report(size, "approx" if approximate else "exact", build_ms, timings,
+                                self.recall(results, exact_results))
+
+                    # The path scan_detail_view takes: restricted to one user's scans
+                    timings, results, expected = [], [], []
+                    for q, allowed in zip(queries, users):
+                        started = time.perf_counter()
+                        results.append(index.search(index.vector_for(q), k=k, allowed_ids=allowed, exclude_ids=[q]))
+                        timings.append((time.perf_counter() - started) * 1000)
+                        others = allowed[allowed != q]
+                        scores = np.asarray(vectors[others], dtype=np.float32) @ index.vector_for(q)
+                        expected.append([(int(i), 0.0) for i in others[np.argsort(scores)[::-1][:k]]])
+                    self.report(size, ("approx" if approximate else "exact") + "+user", build_ms, timings,
+                                self.recall(results, expected))
+
+    def report(self, size, mode, build_ms, timings, recall):
+        self.stdout.write(
+            f"{size:>10} {mode:>12} {build_ms:>10.1f} "
+            f"{np.percentile(timings, 50):>8.2f} {np.percentile(timings, 95):>8.2f} {recall:>7.3f}"
+        )
+
+    def recall(self, results, expected):
+        hits = sum(len({i for i, _ in got} & {i for i, _ in want}) for got, want in zip(results, expected))
+        return hits / max(1, sum(len(want) for want in expected))
@@ -0,0 +1,93 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SAMPLE_IMAGE = os.path.join(settings.MEDIA_ROOT, "uploads", "ISIC_0024310.jpg")
+
+
+def memory_kb(pid):
+    """Return ``(rss, pss)`` in kB; PSS splits shared pages between processes."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0])
+    return values["Rss"], values["Pss"]
+
+
+class Command(BaseCommand):
+    help = "Measure per-worker and total memory with the model in-process vs. in the inference sidecar."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--modes", nargs="+", default=["local", "sidecar"], choices=["local", "sidecar"])
+        parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options["child"]:
+            return self.run_child()
+        if not os.path.exists("/proc/self/smaps_rollup"):
+            raise CommandError("Needs Linux /proc/<pid>/smaps_rollup.")
+
+        self.stdout.write(f"{'mode':<8} {'workers':>7} {'worker RSS MB':>14} {'worker PSS MB':>14} "
+                          f"{'sidecar PSS MB':>15} {'total PSS MB':>13}")
+        for mode in options["modes"]:
+            for count in options["workers"]:
+                self.measure(mode, count)
+
+    def measure(self, mode, count):
+        env = dict(os.environ, INFERENCE_MODE=mode)
+        sidecar = None
+        procs = []
+        with tempfile.TemporaryDirectory() as tmp:
+            env["INFERENCE_SOCKET"] = os.path.join(tmp, "inference.sock")
+            try:
+                if mode == "sidecar":
+                    sidecar = subprocess.Popen(
+                        [sys.executable, "manage.py", "inference_server", "--skip-checks"],
+                        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                    )
+                    sidecar.stdout.readline()
+
+                for _ in range(count):
+                    procs.append(subprocess.Popen(
+                        [sys.executable, "manage.py", "bench_worker_memory", "--child", "--skip-checks"],
+                        env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                    ))
+                for proc in procs:
+                    if proc.stdout.readline().strip() != "ready":
+                        raise CommandError(f"Worker failed in {mode} mode")
+
+                workers = [memory_kb(proc.pid) for proc in procs]
+                sidecar_pss = memory_kb(sidecar.pid)[1] if sidecar else 0
+            finally:
+                for proc in procs:
+                    proc.kill()
+                    proc.wait()
+                if sidecar:
+                    sidecar.kill()
+                    sidecar.wait()
+
+        rss = sum(r for r, _ in workers) / count / 1024
+        pss = sum(p for _, p in workers) / count / 1024
+        total = (sum(p for _, p in workers) + sidecar_pss) / 1024
+        self.stdout.write(f"{mode:<8} {count:>7} {rss:>14.0f} {pss:>14.0f} {sidecar_pss / 1024:>15.0f} {total:>13.0f}")
+
+    def run_child(self):
+        # What a web worker holds after serving one upload
+        from prediction.views import upload_skin_view  # noqa: F401 - imports the model in local mode
+        from prediction.inference import preprocess_image, run_model
+        import numpy as np
+
+        run_model(np.expand_dims(preprocess_image(SAMPLE_IMAGE), axis=0))
+        time.sleep(0.5)
+        sys.stdout.write("ready\n")
+        sys.stdout.flush()
+        sys.stdin.readline()
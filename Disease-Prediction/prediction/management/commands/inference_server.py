@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from prediction.inference import BatchingPredictor, InferenceUnavailable, SidecarServer, get_local_model
+
+
+class Command(BaseCommand):
+    help = "Run the model inference sidecar that web workers reach over a Unix socket (INFERENCE_MODE = 'sidecar')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=getattr(settings, "INFERENCE_SOCKET", "/tmp/oncoderma-inference.sock"))
+        parser.add_argument("--max-batch", type=int, default=getattr(settings, "INFERENCE_MAX_BATCH", 32))
+        parser.add_argument("--max-wait-ms", type=float, default=getattr(settings, "INFERENCE_MAX_WAIT_MS", 5))
+
+    def handle(self, *args, **options):
+        try:
+            model = get_local_model()
+        except InferenceUnavailable as e:
+            raise CommandError(str(e))
+
+        predictor = BatchingPredictor(model, max_batch=options["max_batch"], max_wait=options["max_wait_ms"] / 1000)
+        with SidecarServer(options["socket"], predictor) as server:
+            self.stdout.write(f"Inference sidecar listening on {options['socket']}", ending="\n")
+            self.stdout.flush()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0004_userprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path_prefix', models.CharField(blank=True, help_text='Leave blank to match every path.', max_length=255)),
+                ('sample_rate', models.FloatField(default=1.0, help_text='Fraction of matching requests to profile (0-1).')),
+                ('mode', models.CharField(choices=[('sample', 'Stack sampling'), ('cprofile', 'cProfile')], default='sample', max_length=20)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, help_text='Leave blank to match every user.', null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('view_name', models.CharField(blank=True, max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('mode', models.CharField(choices=[('sample', 'Stack sampling'), ('cprofile', 'cProfile')], max_length=20)),
+                ('duration_ms', models.FloatField()),
+                ('folded_stacks', models.TextField(blank=True, help_text="Stack-sampling profiles only: Brendan Gregg folded format, one 'frame;frame;frame sample_count' per line.")),
+                ('stats', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('rule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prediction.profilingrule')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
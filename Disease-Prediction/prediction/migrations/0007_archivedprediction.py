@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0006_prediction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPrediction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('patient_name', models.CharField(max_length=100)),
+                ('scan_type', models.CharField(max_length=50)),
+                ('result', models.CharField(max_length=50)),
+                ('confidence', models.FloatField()),
+                ('risk_level', models.CharField(max_length=50)),
+                ('timestamp', models.DateTimeField()),
+                ('image_name', models.CharField(blank=True, max_length=255)),
+                ('shard', models.CharField(blank=True, help_text='Archive shard holding the image, relative to ARCHIVE_ROOT.', max_length=255)),
+                ('member', models.CharField(blank=True, help_text='Image path inside the shard.', max_length=255)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'timestamp'], name='prediction__user_id_a8cca5_idx')],
+            },
+        ),
+    ]
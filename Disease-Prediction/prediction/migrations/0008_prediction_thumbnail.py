@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0007_archivedprediction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to='thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='prediction',
+            name='thumbnail_failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
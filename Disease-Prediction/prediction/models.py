@@ -3,13 +3,17 @@ from django.contrib.auth.models import User  # Use Django's built-in User
 
 class Prediction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    patient_name = models.CharField(max_length=100)
-    scan_type = models.CharField(max_length=50)
-    result = models.CharField(max_length=50)
+    patient_name = models.CharField(max_length=100, db_index=True)
+    scan_type = models.CharField(max_length=50, db_index=True)
+    result = models.CharField(max_length=50, db_index=True)
     confidence = models.FloatField()
-    risk_level = models.CharField(max_length=50)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    risk_level = models.CharField(max_length=50, db_index=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
     image_file = models.FileField(upload_to='uploads/', default='default.jpg')
+    # Admin list thumbnail, written at upload or by `manage.py backfill_thumbnails`;
+    # thumbnail_failed records images that could not be decoded so they are not retried
+    thumbnail = models.FileField(upload_to='thumbnails/', blank=True)
+    thumbnail_failed = models.BooleanField(default=False)
 
     def __str__(self):
         return f"{self.patient_name} - {self.result} ({self.timestamp})"
@@ -27,4 +31,62 @@ class UserProfile(models.Model):
     research_participation = models.BooleanField(default=False)
 
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+class ProfilingRule(models.Model):
+    MODE_CHOICES = [
+        ('sample', 'Stack sampling'),
+        ('cprofile', 'cProfile'),
+    ]
+
+    path_prefix = models.CharField(max_length=255, blank=True, help_text="Leave blank to match every path.")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True, help_text="Leave blank to match every user.")
+    sample_rate = models.FloatField(default=1.0, help_text="Fraction of matching requests to profile (0-1).")
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='sample')
+    enabled = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.path_prefix or '*'} / {self.user or '*'} @ {self.sample_rate:g}"
+
+
+class RequestProfile(models.Model):
+    rule = models.ForeignKey(ProfilingRule, on_delete=models.SET_NULL, blank=True, null=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    path = models.CharField(max_length=255)
+    view_name = models.CharField(max_length=255, blank=True)
+    method = models.CharField(max_length=10)
+    status_code = models.PositiveSmallIntegerField()
+    mode = models.CharField(max_length=20, choices=ProfilingRule.MODE_CHOICES)
+    duration_ms = models.FloatField()
+    folded_stacks = models.TextField(
+        blank=True,
+        help_text="Stack-sampling profiles only: Brendan Gregg folded format, one 'frame;frame;frame sample_count' per line.",
+    )
+    stats = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class ArchivedPrediction(models.Model):
+    # Keeps the original Prediction id so scan URLs and embeddings stay valid
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    patient_name = models.CharField(max_length=100)
+    scan_type = models.CharField(max_length=50)
+    result = models.CharField(max_length=50)
+    confidence = models.FloatField()
+    risk_level = models.CharField(max_length=50)
+    timestamp = models.DateTimeField()
+    image_name = models.CharField(max_length=255, blank=True)
+    shard = models.CharField(max_length=255, blank=True, help_text="Archive shard holding the image, relative to ARCHIVE_ROOT.")
+    member = models.CharField(max_length=255, blank=True, help_text="Image path inside the shard.")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'timestamp'])]
+
+    def __str__(self):
+        return f"{self.patient_name} - {self.result} ({self.timestamp}) [archived]"
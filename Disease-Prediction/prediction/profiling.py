@@ -0,0 +1,184 @@
+import cProfile
+import io
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ProfilingRule, RequestProfile
+
+# --------------------------
+# PROFILING RULES
+# --------------------------
+# Rules are read from the database so profiling can be switched on for a
+# path or a user from the admin. They are cached per process for a few
+# seconds, so with no rules enabled the middleware costs one clock read and
+# an empty list check per request.
+
+_rules = []
+_rules_loaded_at = float("-inf")
+_rules_lock = threading.Lock()
+
+
+def active_rules():
+    global _rules, _rules_loaded_at
+    ttl = getattr(settings, "PROFILING_RULES_TTL", 30)
+    now = time.monotonic()
+    if now - _rules_loaded_at > ttl:
+        with _rules_lock:
+            if now - _rules_loaded_at > ttl:
+                try:
+                    _rules = list(ProfilingRule.objects.filter(enabled=True, sample_rate__gt=0))
+                except DatabaseError:
+                    # Table missing before migrate; retry after the TTL
+                    _rules = []
+                _rules_loaded_at = now
+    return _rules
+
+
+@receiver([post_save, post_delete], sender=ProfilingRule)
+def _invalidate_rules(**kwargs):
+    global _rules_loaded_at
+    _rules_loaded_at = float("-inf")
+
+
+def _matching_rule(request):
+    for rule in active_rules():
+        if rule.path_prefix and not request.path.startswith(rule.path_prefix):
+            continue
+        if rule.user_id is not None and rule.user_id != request.user.id:
+            continue
+        if random.random() < rule.sample_rate:
+            return rule
+    return None
+
+
+# --------------------------
+# PROFILERS
+# --------------------------
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer and counts folded stacks."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common())
+
+
+def _cprofile_stats(profiler, limit=60):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return out.getvalue()
+
+
+def _cprofile_edges(profiler, limit=60):
+    # cProfile only records caller/callee pairs, not whole stacks, so this is
+    # a ranked edge summary rather than folded stacks: each edge's inclusive
+    # time also counts everything nested below it, so edges do not add up
+    edges = []
+    for func, (_, _, _, _, callers) in pstats.Stats(profiler).stats.items():
+        callee = f"{func[2]} ({func[0]}:{func[1]})"
+        for caller, (calls, _, _, cumtime) in callers.items():
+            edges.append((cumtime, calls, f"{caller[2]} ({caller[0]}:{caller[1]})", callee))
+    edges.sort(reverse=True)
+
+    lines = [
+        "Caller -> callee edges by inclusive time (nested time is counted on every edge above it; not a flamegraph)",
+        f"{'cum ms':>10} {'calls':>8}  edge",
+    ]
+    for cumtime, calls, caller, callee in edges[:limit]:
+        lines.append(f"{cumtime * 1000:>10.2f} {calls:>8}  {caller} -> {callee}")
+    return "\n".join(lines)
+
+
+# --------------------------
+# MIDDLEWARE
+# --------------------------
+
+class ProfilingMiddleware:
+    """Profiles a sampled fraction of requests matching an enabled ProfilingRule."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.interval = getattr(settings, "PROFILING_SAMPLE_INTERVAL", 0.005)
+
+    def __call__(self, request):
+        rule = _matching_rule(request)
+        if rule is None:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        if rule.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            # Only sampled stacks are stored as folded stacks (see _cprofile_edges)
+            folded, stats = "", _cprofile_stats(profiler) + "\n" + _cprofile_edges(profiler)
+        else:
+            sampler = StackSampler(self.interval)
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+            if not sampler.counts:
+                # Finished inside one sampling interval: nothing worth storing
+                return response
+            folded, stats = sampler.folded(), ""
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            RequestProfile.objects.create(
+                rule=rule,
+                user=request.user if request.user.is_authenticated else None,
+                path=request.path[:255],
+                view_name=getattr(request.resolver_match, "view_name", "") or "",
+                method=request.method,
+                status_code=response.status_code,
+                mode=rule.mode,
+                duration_ms=duration_ms,
+                folded_stacks=folded,
+                stats=stats,
+            )
+        except Exception as e:
+            print(f"Error saving request profile: {e}")
+
+        return response
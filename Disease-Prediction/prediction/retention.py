@@ -0,0 +1,181 @@
+import json
+import os
+import statistics
+import time
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedPrediction, Prediction
+
+# --------------------------
+# TIERED RETENTION
+# --------------------------
+# Scans older than RETENTION_DAYS move out of the hot Prediction table into
+# ArchivedPrediction (same id), and their images are packed into zip shards
+# under ARCHIVE_ROOT. Each ArchivedPrediction row records its shard and
+# member name, so that table doubles as the archive index; every shard also
+# carries a manifest.json so it can be restored on its own.
+
+ARCHIVED_FIELDS = ('id', 'user_id', 'patient_name', 'scan_type', 'result', 'confidence', 'risk_level', 'timestamp')
+
+
+def archive_root():
+    return getattr(settings, "ARCHIVE_ROOT", os.path.join(settings.BASE_DIR, "archive"))
+
+
+def _file_size(name):
+    try:
+        return default_storage.size(name)
+    except (OSError, NotImplementedError):
+        return 0
+
+
+def _write_shard(scans):
+    """Pack the batch's images into one zip shard; return (shard, members)."""
+    os.makedirs(archive_root(), exist_ok=True)
+    shard = f"shard-{timezone.now():%Y%m%d%H%M%S}-{scans[0].id}.zip"
+    path = os.path.join(archive_root(), shard)
+    members = {}
+
+    with zipfile.ZipFile(path + ".tmp", "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for scan in scans:
+            name = scan.image_file.name
+            if not name or not default_storage.exists(name):
+                continue
+            member = f"{scan.id}/{os.path.basename(name)}"
+            with default_storage.open(name, "rb") as f:
+                zf.writestr(member, f.read())
+            members[scan.id] = member
+        manifest = [
+            {**{field: str(getattr(scan, field)) for field in ARCHIVED_FIELDS}, "member": members.get(scan.id, "")}
+            for scan in scans
+        ]
+        zf.writestr("manifest.json", json.dumps(manifest, indent=1))
+
+    # Only a complete shard ever appears under its final name
+    os.replace(path + ".tmp", path)
+    return shard, members
+
+
+def archive_batch(scans):
+    """Archive one batch of Prediction rows; return bytes freed from media."""
+    shard, members = _write_shard(scans)
+
+    try:
+        with transaction.atomic():
+            ArchivedPrediction.objects.bulk_create([
+                ArchivedPrediction(
+                    **{field: getattr(scan, field) for field in ARCHIVED_FIELDS},
+                    image_name=scan.image_file.name or "",
+                    shard=shard if scan.id in members else "",
+                    member=members.get(scan.id, ""),
+                )
+                for scan in scans
+            ])
+            Prediction.objects.filter(id__in=[scan.id for scan in scans]).delete()
+    except Exception:
+        # Nothing was archived, so the shard's manifest would be lying
+        os.remove(os.path.join(archive_root(), shard))
+        raise
+
+    # Files are removed only after the rows are committed, and only when no
+    # remaining hot scan points at the same file (e.g. the default image)
+    names = {scan.image_file.name for scan in scans if scan.id in members}
+    still_used = set(Prediction.objects.filter(image_file__in=names).values_list("image_file", flat=True))
+    freed = 0
+    for name in names - still_used:
+        freed += _file_size(name)
+        default_storage.delete(name)
+    for scan in scans:
+        if scan.thumbnail:
+            freed += _file_size(scan.thumbnail.name)
+            default_storage.delete(scan.thumbnail.name)
+    return freed
+
+
+def _archive_size():
+    root = archive_root()
+    if not os.path.isdir(root):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(root) if entry.name.endswith(".zip"))
+
+
+def _hot_query_ms(repeat=3):
+    """Median time of the dashboard-style aggregate queries on the hot table."""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        Prediction.objects.count()
+        Prediction.objects.filter(risk_level__startswith="Low Risk").count()
+        list(Prediction.objects.order_by("-timestamp")[:50])
+        runs.append((time.perf_counter() - started) * 1000)
+    return statistics.median(runs)
+
+
+def archive_old_scans(older_than_days=None, batch_size=500, dry_run=False, log=print):
+    """Move scans older than ``older_than_days`` to the archive tier and report the outcome."""
+    if older_than_days is None:
+        older_than_days = getattr(settings, "RETENTION_DAYS", 365)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    candidates = Prediction.objects.filter(timestamp__lt=cutoff).order_by("id")
+
+    report = {
+        "cutoff": cutoff,
+        "candidates": candidates.count(),
+        "archived": 0,
+        "media_bytes_freed": 0,
+        "shard_bytes_written": 0,
+        "hot_rows_before": Prediction.objects.count(),
+        "hot_query_ms_before": _hot_query_ms(),
+    }
+    if dry_run:
+        return report
+
+    shards_before = _archive_size()
+    while True:
+        scans = list(candidates[:batch_size])
+        if not scans:
+            break
+        report["media_bytes_freed"] += archive_batch(scans)
+        report["archived"] += len(scans)
+        log(f"Archived {report['archived']}/{report['candidates']} scans")
+
+    report["shard_bytes_written"] = _archive_size() - shards_before
+    report["hot_rows_after"] = Prediction.objects.count()
+    report["hot_query_ms_after"] = _hot_query_ms()
+    return report
+
+
+def run_scheduled_retention():
+    """Entry point for cron / task schedulers; archives with the configured settings."""
+    return archive_old_scans(batch_size=getattr(settings, "RETENTION_BATCH_SIZE", 500))
+
+
+# --------------------------
+# ON-DEMAND ACCESS
+# --------------------------
+
+def find_scan(user, scan_id):
+    """Return the user's scan from the hot table, falling back to the archive."""
+    scan = Prediction.objects.filter(id=scan_id, user=user).first()
+    if scan is None:
+        scan = ArchivedPrediction.objects.filter(id=scan_id, user=user).first()
+    return scan
+
+
+def read_archived_image(archived):
+    """Return the raw image bytes of an archived scan, or None."""
+    if not archived.shard or not archived.member:
+        return None
+    path = os.path.join(archive_root(), archived.shard)
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return zf.read(archived.member)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        print(f"Archive read error for scan {archived.id}: {e}")
+        return None
@@ -1,3 +1,508 @@
-from django.test import TestCase
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import reverse
+from django.utils import timezone
+from django.core.files.base import ContentFile
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from . import embeddings, profiling
+from .embeddings import EmbeddingStore, SimilarityIndex, build_index, get_index, similar_prediction_ids
+from .inference import INPUT_SIZE, BatchingPredictor, InferenceUnavailable, SidecarClient, SidecarServer
+from .models import ArchivedPrediction, Prediction, ProfilingRule, RequestProfile
+from .retention import archive_batch, archive_old_scans, find_scan
+from .thumbnails import make_thumbnail
+
+
+def _append_rows(directory, worker, rows):
+    store = EmbeddingStore(directory)
+    for i in range(rows):
+        scan_id = worker * 100000 + i
+        # The vector encodes its id, so a mispaired row is detectable
+        store.add([scan_id], np.full((1, 4), scan_id, dtype=np.float32) + [1, 0, 0, 0])
+
+
+class EmbeddingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(EMBEDDINGS_DIR=self.directory, SIMILARITY_APPROXIMATE_MIN_VECTORS=1000)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.store = EmbeddingStore()
+        self.rng = np.random.default_rng(0)
+
+    def random_vectors(self, n, dim=16):
+        return self.rng.standard_normal((n, dim)).astype(np.float32)
+
+
+class EmbeddingStoreTests(EmbeddingTestCase):
+    def test_add_and_load_round_trip(self):
+        vectors = self.random_vectors(3)
+        self.store.add([7, 8, 9], vectors)
+
+        ids, loaded = self.store.load()
+        self.assertEqual(ids.tolist(), [7, 8, 9])
+        self.assertEqual(len(self.store), 3)
+        expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.testing.assert_allclose(np.asarray(loaded, dtype=np.float32), expected, atol=1e-3)
+
+    def test_rejects_dimension_change(self):
+        self.store.add([1], self.random_vectors(1, dim=16))
+        with self.assertRaises(ValueError):
+            self.store.add([2], self.random_vectors(1, dim=8))
+
+    def test_half_written_row_is_ignored_then_truncated(self):
+        self.store.add([1, 2], self.random_vectors(2))
+        # A writer that died after the vector write but before the id write
+        with open(self.store.vectors_path, "ab") as f:
+            f.write(np.zeros(16, dtype=np.float16).tobytes())
+        self.assertEqual(len(self.store), 2)
+
+        self.store.add([3], self.random_vectors(1))
+        ids, vectors = self.store.load()
+        self.assertEqual(ids.tolist(), [1, 2, 3])
+        self.assertEqual(os.path.getsize(self.store.vectors_path), 3 * 16 * 2)
+
+    @unittest.skipIf(embeddings.fcntl is None, "needs fcntl")
+    def test_concurrent_processes_keep_ids_and_vectors_paired(self):
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=_append_rows, args=(self.directory, w, 200)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        ids, vectors = self.store.load()
+        self.assertEqual(len(ids), 800)
+        raw = np.asarray(ids, dtype=np.float32)[:, None] + [1, 0, 0, 0]
+        np.testing.assert_allclose(
+            np.asarray(vectors, dtype=np.float32),
+            raw / np.linalg.norm(raw, axis=1, keepdims=True),
+            atol=1e-3,
+        )
+
+    def test_clear_removes_index(self):
+        self.store.add([1, 2], self.random_vectors(2))
+        build_index(self.store)
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertFalse(os.path.exists(self.store.index_path))
+
+
+class SimilarityIndexTests(EmbeddingTestCase):
+    def test_exact_search_excludes_query_and_ranks_by_cosine(self):
+        self.store.add([1, 2, 3], [[1, 0], [0.9, 0.1], [0, 1]])
+        ids, vectors = self.store.load()
+        index = SimilarityIndex(ids, vectors)
+
+        results = index.search(index.vector_for(1), k=2, exclude_ids=[1])
+        self.assertEqual([scan_id for scan_id, _ in results], [2, 3])
+
+    def test_vector_for_returns_newest_row(self):
+        self.store.add([5], [[1, 0]])
+        self.store.add([5], [[0, 1]])
+        ids, vectors = self.store.load()
+        np.testing.assert_allclose(SimilarityIndex(ids, vectors).vector_for(5), [0, 1], atol=1e-3)
+
+    def test_approximate_search_returns_every_allowed_scan(self):
+        self.store.add(np.arange(5000), self.random_vectors(5000))
+        ids, vectors = self.store.load()
+        index = SimilarityIndex(ids, vectors, approximate=True, n_probe=1)
+        allowed = self.rng.choice(5000, size=20, replace=False)
+
+        results = index.search(index.vector_for(allowed[0]), k=10, allowed_ids=allowed, exclude_ids=[allowed[0]])
+        self.assertEqual(len(results), 10)
+        self.assertTrue({scan_id for scan_id, _ in results} <= set(allowed[1:].tolist()))
+
+    def test_rows_added_after_build_are_searchable(self):
+        self.store.add(np.arange(2000), self.random_vectors(2000))
+        built = build_index(self.store)
+        self.assertIsNotNone(built.ivf)
+
+        query = self.random_vectors(1)
+        self.store.add([99999], query)
+        index = get_index()
+        self.assertIsNotNone(index.ivf)
+        self.assertEqual(index._indexed, 2000)
+        self.assertEqual(len(index), 2001)
+        self.assertEqual(index.search(query, k=1)[0][0], 99999)
+        self.assertEqual(index.rows_for([99999, 3]).tolist(), [3, 2000])
+
+    def test_tail_row_overrides_indexed_row(self):
+        self.store.add([1, 2], [[1, 0], [0, 1]])
+        build_index(self.store)
+        self.store.add([1], [[0, 1]])
+
+        self.assertEqual(similar_prediction_ids(1, k=1)[0][0], 2)
+        self.assertAlmostEqual(similar_prediction_ids(1, k=1)[0][1], 1.0, places=2)
+
+    def test_get_index_without_build_is_exact_over_tail(self):
+        self.store.add(np.arange(2000), self.random_vectors(2000))
+        index = get_index()
+        self.assertIsNone(index.ivf)
+        self.assertEqual(index._indexed, 0)
+        self.assertEqual(index.rows_for([1999, 0]).tolist(), [0, 1999])
+
+    def test_get_index_reloads_rebuilt_artifact(self):
+        self.store.add(np.arange(10), self.random_vectors(10))
+        self.assertEqual(get_index()._indexed, 0)
+        build_index(self.store)
+        self.assertEqual(get_index()._indexed, 10)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(username="thumbs")
+
+    def make_scan(self, data):
+        scan = Prediction(user=self.user, patient_name="p", scan_type="Dermoscopy", result="r", confidence=1, risk_level="l")
+        scan.image_file.save("scan.png", ContentFile(data))
+        return scan
+
+    def test_thumbnail_is_saved_on_the_scan(self):
+        scan = self.make_scan(self.png())
+
+        self.assertTrue(make_thumbnail(scan))
+        scan.refresh_from_db()
+        self.assertEqual(scan.thumbnail.name, f"thumbnails/{scan.pk}.jpg")
+        with scan.thumbnail.open("rb") as f:
+            self.assertLessEqual(max(Image.open(f).size), 96)
+
+    def test_undecodable_image_is_flagged(self):
+        scan = self.make_scan(b"not an image")
+
+        self.assertFalse(make_thumbnail(scan))
+        scan.refresh_from_db()
+        self.assertTrue(scan.thumbnail_failed)
+        self.assertFalse(scan.thumbnail)
+
+    def png(self):
+        out = BytesIO()
+        Image.new("RGB", (400, 300), "red").save(out, "PNG")
+        return out.getvalue()
+
+    def test_storage_error_is_flagged_not_raised(self):
+        scan = self.make_scan(self.png())
+
+        with mock.patch("django.core.files.storage.FileSystemStorage._save", side_effect=OSError("No space left on device")):
+            self.assertFalse(make_thumbnail(scan))
+        scan.refresh_from_db()
+        self.assertTrue(scan.thumbnail_failed)
+        self.assertFalse(scan.thumbnail)
+
+    def test_changelist_renders_thumbnail_image(self):
+        scan = self.make_scan(self.png())
+        make_thumbnail(scan)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pw"))
+
+        response = self.client.get(reverse("admin:prediction_prediction_changelist"))
+        self.assertContains(response, f'<img src="/media/thumbnails/{scan.pk}.jpg"')
+        self.assertContains(response, "<span>Image</span>")
+
+
+class _SumModel:
+    def predict(self, img_batch):
+        return img_batch.sum(axis=(1, 2, 3))[:, None], None
+
+
+class SidecarTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.socket_path = os.path.join(directory, "inference.sock")
+        # A long window so concurrent requests land in the same model call
+        server = SidecarServer(self.socket_path, BatchingPredictor(_SumModel(), max_wait=0.2))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_malformed_request_does_not_fail_the_batch(self):
+        good = np.ones((2, *INPUT_SIZE, 3), dtype=np.float32)
+        outcome = {}
+
+        def send(name, batch):
+            try:
+                outcome[name] = SidecarClient(self.socket_path).predict(batch)[0]
+            except InferenceUnavailable as e:
+                outcome[name] = e
+
+        threads = [
+            threading.Thread(target=send, args=("good", good)),
+            threading.Thread(target=send, args=("bad", np.ones((1, 32, 32, 3), dtype=np.float32))),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        np.testing.assert_array_equal(outcome["good"], [[28 * 28 * 3], [28 * 28 * 3]])
+        self.assertIsInstance(outcome["bad"], InferenceUnavailable)
+        self.assertIn("(1, 32, 32, 3)", str(outcome["bad"]))
+
+
+class FoldedStacksDownloadTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pw"))
+
+    def profile(self, mode, folded):
+        return RequestProfile.objects.create(
+            path="/", method="GET", status_code=200, mode=mode, duration_ms=1, folded_stacks=folded,
+        )
+
+    def download(self, *profiles):
+        return self.client.post(reverse("admin:prediction_requestprofile_changelist"), {
+            "action": "download_folded_stacks",
+            "_selected_action": [p.pk for p in profiles],
+        })
+
+    def test_sample_counts_are_merged(self):
+        response = self.download(self.profile("sample", "a;b 3\na;c 1"), self.profile("sample", "a;b 2"))
+        self.assertEqual(response.content.decode(), "a;b 5\na;c 1")
+
+    def test_mixed_selection_is_refused(self):
+        response = self.download(self.profile("sample", "a;b 3"), self.profile("cprofile", ""))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn("Content-Disposition", response)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        media, archive = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.addCleanup(shutil.rmtree, archive)
+        self.archive = archive
+        settings_override = override_settings(MEDIA_ROOT=media, ARCHIVE_ROOT=archive)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(username="patient")
+
+    def make_scan(self, days_old=400, image=b"image bytes", user=None, patient_name="p"):
+        scan = Prediction(
+            user=user or self.user, patient_name=patient_name, scan_type="Dermoscopy",
+            result="Melanoma (mel)", confidence=90, risk_level="High Risk",
+        )
+        scan.image_file.save("scan.png", ContentFile(image))
+        Prediction.objects.filter(pk=scan.pk).update(timestamp=timezone.now() - timedelta(days=days_old))
+        return Prediction.objects.get(pk=scan.pk)
+
+    def test_failed_transaction_removes_the_shard(self):
+        scan = self.make_scan()
+
+        with mock.patch.object(ArchivedPrediction.objects, "bulk_create", side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                archive_batch([scan])
+        self.assertEqual(os.listdir(self.archive), [])
+        self.assertTrue(Prediction.objects.filter(pk=scan.pk).exists())
+        self.assertTrue(scan.image_file.storage.exists(scan.image_file.name))
+
+    def test_archive_batch_moves_rows_and_images(self):
+        scan = self.make_scan()
+        image_name = scan.image_file.name
+
+        archive_batch([scan])
+
+        self.assertFalse(Prediction.objects.filter(pk=scan.pk).exists())
+        archived = ArchivedPrediction.objects.get(pk=scan.pk)
+        self.assertEqual((archived.user, archived.result, archived.image_name), (self.user, scan.result, image_name))
+        self.assertFalse(scan.image_file.storage.exists(image_name))
+        with zipfile.ZipFile(os.path.join(self.archive, archived.shard)) as zf:
+            self.assertEqual(zf.read(archived.member), b"image bytes")
+            self.assertIn("manifest.json", zf.namelist())
+
+    def test_image_still_used_by_a_hot_scan_is_kept(self):
+        old = self.make_scan()
+        recent = self.make_scan(days_old=1)
+        Prediction.objects.filter(pk=recent.pk).update(image_file=old.image_file.name)
+
+        archive_batch([old])
+        self.assertTrue(old.image_file.storage.exists(old.image_file.name))
+
+    def test_thumbnail_is_deleted(self):
+        scan = self.make_scan()
+        scan.thumbnail.save(f"{scan.pk}.jpg", ContentFile(b"thumb"))
+        thumbnail_name = scan.thumbnail.name
+
+        archive_batch([scan])
+        self.assertFalse(scan.thumbnail.storage.exists(thumbnail_name))
+
+    def test_dry_run_changes_nothing(self):
+        scan = self.make_scan()
+        self.make_scan(days_old=1)
+
+        report = archive_old_scans(older_than_days=365, dry_run=True, log=lambda message: None)
+        self.assertEqual(report["candidates"], 1)
+        self.assertEqual(report["archived"], 0)
+        self.assertEqual(Prediction.objects.count(), 2)
+        self.assertFalse(ArchivedPrediction.objects.exists())
+        self.assertEqual(os.listdir(self.archive), [])
+        self.assertTrue(scan.image_file.storage.exists(scan.image_file.name))
+
+    def test_archive_old_scans_only_takes_scans_past_the_cutoff(self):
+        old, recent = self.make_scan(), self.make_scan(days_old=1)
+
+        report = archive_old_scans(older_than_days=365, batch_size=1, log=lambda message: None)
+        self.assertEqual(report["archived"], 1)
+        self.assertEqual(list(ArchivedPrediction.objects.values_list("id", flat=True)), [old.pk])
+        self.assertTrue(Prediction.objects.filter(pk=recent.pk).exists())
+
+    def test_find_scan_falls_back_to_the_archive(self):
+        scan, recent = self.make_scan(), self.make_scan(days_old=1)
+        archive_batch([scan])
+
+        self.assertIsInstance(find_scan(self.user, scan.pk), ArchivedPrediction)
+        self.assertIsInstance(find_scan(self.user, recent.pk), Prediction)
+        self.assertIsNone(find_scan(User.objects.create(username="other"), scan.pk))
+
+    def test_archived_image_is_served_to_its_owner_only(self):
+        scan = self.make_scan(image=b"archived image")
+        archive_batch([scan])
+        url = reverse("archived_image", args=[scan.pk])
+
+        self.client.force_login(User.objects.create(username="other"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"archived image")
+
+    def test_history_lists_archived_scans_on_request(self):
+        archive_batch([self.make_scan(patient_name="archived-patient")])
+        self.make_scan(days_old=1, patient_name="recent-patient")
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("history"))
+        self.assertContains(response, "recent-patient")
+        self.assertNotContains(response, "archived-patient")
+
+        response = self.client.get(reverse("history"), {"archived": "1"})
+        self.assertContains(response, "archived-patient")
+        self.assertNotContains(response, "recent-patient")
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_INTERVAL=0.001)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        profiling._invalidate_rules()
+        self.addCleanup(profiling._invalidate_rules)
+        self.user = User.objects.create(username="profiled")
+        self.factory = RequestFactory()
+
+    def request(self, path="/history/", user=None):
+        request = self.factory.get(path)
+        request.user = user or AnonymousUser()
+        return request
+
+    def slow_view(self, request):
+        time.sleep(0.05)
+        return HttpResponse("ok")
+
+    def test_disabled_setting_removes_the_middleware(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                profiling.ProfilingMiddleware(self.slow_view)
+
+    def test_path_prefix_matching(self):
+        rule = ProfilingRule.objects.create(path_prefix="/history/")
+        self.assertEqual(profiling._matching_rule(self.request("/history/?q=x")), rule)
+        self.assertIsNone(profiling._matching_rule(self.request("/dashboard/")))
+
+    def test_user_matching(self):
+        rule = ProfilingRule.objects.create(user=self.user)
+        other = User.objects.create(username="other")
+        self.assertEqual(profiling._matching_rule(self.request(user=self.user)), rule)
+        self.assertIsNone(profiling._matching_rule(self.request(user=other)))
+        self.assertIsNone(profiling._matching_rule(self.request()))
+
+    def test_rule_without_user_matches_anonymous_requests(self):
+        rule = ProfilingRule.objects.create()
+        self.assertEqual(profiling._matching_rule(self.request()), rule)
+
+    def test_zero_sample_rate_never_matches(self):
+        ProfilingRule.objects.create(sample_rate=0)
+        self.assertIsNone(profiling._matching_rule(self.request()))
+
+    def test_saving_a_rule_invalidates_the_cache(self):
+        rule = ProfilingRule.objects.create()
+        self.assertEqual(profiling.active_rules(), [rule])
+
+        rule.enabled = False
+        rule.save()
+        self.assertEqual(profiling.active_rules(), [])
+
+    def test_sample_mode_stores_folded_stacks(self):
+        ProfilingRule.objects.create(mode="sample")
+        response = profiling.ProfilingMiddleware(self.slow_view)(self.request(user=self.user))
+
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.mode, profile.user, profile.path), ("sample", self.user, "/history/"))
+        self.assertIn("slow_view", profile.folded_stacks)
+        self.assertEqual(profile.stats, "")
+
+    def test_cprofile_mode_stores_stats_without_folded_stacks(self):
+        ProfilingRule.objects.create(mode="cprofile")
+        profiling.ProfilingMiddleware(self.slow_view)(self.request())
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.mode, "cprofile")
+        self.assertEqual(profile.folded_stacks, "")
+        self.assertIn("slow_view", profile.stats)
+        self.assertIn("Caller -> callee edges", profile.stats)
+
+    @override_settings(PROFILING_SAMPLE_INTERVAL=10)
+    def test_request_without_samples_is_not_stored(self):
+        ProfilingRule.objects.create(mode="sample")
+        response = profiling.ProfilingMiddleware(lambda request: HttpResponse("ok"))(self.request())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class SimilarCasesViewTests(EmbeddingTestCase, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(username="patient")
+
+    def make_scan(self, thumbnail=False):
+        scan = Prediction(user=self.user, patient_name="p", scan_type="Dermoscopy", result="r", confidence=1, risk_level="l")
+        scan.image_file.save("scan.png", ContentFile(b"image"))
+        if thumbnail:
+            scan.thumbnail.save(f"{scan.pk}.jpg", ContentFile(b"thumb"))
+        return scan
+
+    def test_similar_cases_use_thumbnails_when_present(self):
+        query, with_thumb, without_thumb = self.make_scan(), self.make_scan(thumbnail=True), self.make_scan()
+        self.store.add([query.pk, with_thumb.pk, without_thumb.pk], [[1, 0], [0.9, 0.1], [0.8, 0.2]])
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("scan_detail", args=[query.pk]))
+        self.assertContains(response, f'src="{with_thumb.thumbnail.url}"')
+        self.assertNotContains(response, f'src="{with_thumb.image_file.url}"')
+        self.assertContains(response, f'src="{without_thumb.image_file.url}"')
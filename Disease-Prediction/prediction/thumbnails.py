@@ -0,0 +1,37 @@
+from django.core.files.base import ContentFile
+from io import BytesIO
+from PIL import Image
+
+# --------------------------
+# THUMBNAILS
+# --------------------------
+# Small JPEG derivatives of scan images, written once when the scan is
+# saved (or by `manage.py backfill_thumbnails` for older rows) so list
+# pages never touch storage or decode full-size uploads.
+
+THUMBNAIL_SIZE = (96, 96)
+
+
+def make_thumbnail(scan, data=None):
+    """Render and save the scan's thumbnail; return False and flag the scan on failure."""
+    try:
+        if data is None:
+            with scan.image_file.open("rb") as f:
+                data = f.read()
+        img = Image.open(BytesIO(data))
+        img.thumbnail(THUMBNAIL_SIZE)
+        out = BytesIO()
+        img.convert("RGB").save(out, "JPEG", quality=80)
+        # Storage errors (full disk, permissions) are cached like bad images;
+        # `backfill_thumbnails --retry-failed` picks both up again
+        scan.thumbnail.save(f"{scan.pk}.jpg", ContentFile(out.getvalue()), save=False)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Thumbnail error for scan {scan.pk}: {e}")
+        scan.thumbnail = ""
+        scan.thumbnail_failed = True
+        scan.save(update_fields=["thumbnail", "thumbnail_failed"])
+        return False
+
+    scan.thumbnail_failed = False
+    scan.save(update_fields=["thumbnail", "thumbnail_failed"])
+    return True
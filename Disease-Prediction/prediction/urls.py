@@ -9,6 +9,7 @@ urlpatterns = [
     path('upload/', views.upload_skin_view, name="upload"),
     path('history/', views.history_view, name='history'),
     path('scan/<int:scan_id>/', views.scan_detail_view, name='scan_detail'),  # Optional detail page
+    path('scan/<int:scan_id>/archived-image/', views.archived_image_view, name='archived_image'),
 
     path("chat/", views.chat_view, name="chat"),
 
@@ -1,4 +1,4 @@
 from .auth_views import register_view, login_view, logout_view
-from .dashboard_views import dashboard_view, history_view, scan_detail_view
+from .dashboard_views import dashboard_view, history_view, scan_detail_view, archived_image_view
 from .prediction_views import upload_skin_view
 from .chat_views import chat_view
@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 from ..models import Prediction
+from ..retention import find_scan
 from google import genai
 import os
 import json
@@ -29,7 +30,9 @@ def chat_view(request):
             if not message or not scan_id:
                 return JsonResponse({"error": "Missing message or scan_id"}, status=400)
             
-            scan = Prediction.objects.get(id=scan_id, user=request.user)
+            scan = find_scan(request.user, scan_id)
+            if scan is None:
+                raise Prediction.DoesNotExist
             
             client = configure_gemini()
             if not client:
@@ -1,6 +1,12 @@
-from django.shortcuts import render, get_object_or_404
+import mimetypes
+
+from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from ..models import Prediction
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from ..models import ArchivedPrediction, Prediction
+from ..embeddings import similar_prediction_ids
+from ..retention import find_scan, read_archived_image
 from .prediction_views import class_names # Import shared constants
 
 # --------------------------
@@ -41,8 +47,11 @@ def history_view(request):
     filter_val = request.GET.get('filter', 'all')
     search_query = request.GET.get('q', '')
     category_val = request.GET.get('category', '')
+    # Archived scans live in a separate table and are only queried on request
+    archived = request.GET.get('archived') == '1'
 
-    scans = Prediction.objects.filter(user=request.user)
+    model = ArchivedPrediction if archived else Prediction
+    scans = model.objects.filter(user=request.user)
 
     # Search by patient name
     if search_query:
@@ -66,6 +75,7 @@ def history_view(request):
         'filter': filter_val,
         'search_query': search_query,
         'category_filter': category_val,
+        'archived': archived,
         'categories': class_names  # Pass the list of diagnosis categories
     }
 
@@ -77,5 +87,45 @@ def history_view(request):
 
 @login_required(login_url='login')
 def scan_detail_view(request, scan_id):
-    scan = get_object_or_404(Prediction, id=scan_id, user=request.user)
-    return render(request, "scan_detail.html", {"scan": scan})
+    scan = find_scan(request.user, scan_id)
+    if scan is None:
+        raise Http404("Scan not found")
+
+    if isinstance(scan, ArchivedPrediction):
+        image_url = reverse("archived_image", args=[scan.id]) if scan.member else None
+    else:
+        image_url = scan.image_file.url if scan.image_file else None
+
+    # Most visually similar past lesions, restricted to this user's scans
+    similar_scans = []
+    try:
+        user_scan_ids = Prediction.objects.filter(user=request.user).values_list("id", flat=True)
+        matches = similar_prediction_ids(scan.id, allowed_ids=user_scan_ids)
+        found = Prediction.objects.in_bulk([match_id for match_id, _ in matches])
+        similar_scans = [
+            {"scan": found[match_id], "similarity": score * 100}
+            for match_id, score in matches if match_id in found
+        ]
+    except Exception as e:
+        print(f"Similar scan lookup error: {e}")
+
+    return render(request, "scan_detail.html", {
+        "scan": scan,
+        "image_url": image_url,
+        "archived": isinstance(scan, ArchivedPrediction),
+        "similar_scans": similar_scans,
+    })
+
+
+@login_required(login_url='login')
+def archived_image_view(request, scan_id):
+    archived = ArchivedPrediction.objects.filter(id=scan_id, user=request.user).first()
+    data = read_archived_image(archived) if archived else None
+    if data is None:
+        raise Http404("Image not found")
+
+    content_type = mimetypes.guess_type(archived.member)[0] or "application/octet-stream"
+    response = HttpResponse(data, content_type=content_type)
+    # Archived images never change, let the browser keep them
+    response["Cache-Control"] = "private, max-age=86400"
+    return response
@@ -4,18 +4,14 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from ..models import Prediction
 from ..forms import UploadForm
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+from ..embeddings import EmbeddingStore
+from ..thumbnails import make_thumbnail
+from ..inference import InferenceUnavailable, preprocess_image, run_model, warm_up
 import numpy as np
 from io import BytesIO
 
-# Load ML model
-# Note: Path is relative to the project root (where manage.py is run)
-try:
-    model = load_model(r"prediction/skin_cancer_model.h5")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    model = None
+# Load ML model (in-process mode only; the inference sidecar owns it otherwise)
+warm_up()
 
 # model2 =load_model(r"unet_isic2018.h5")
 
@@ -39,6 +35,7 @@ risk_map = {
     'Dermatofibroma (df)': 'Low Risk (benign)'
 }
 
+
 # --------------------------
 # UPLOAD MRI
 # --------------------------
@@ -52,18 +49,16 @@ def upload_skin_view(request):
             scan_type = form.cleaned_data["scan_type"]
             image_file = form.cleaned_data["image_file"]
             
-            if model is None:
-                messages.error(request, "Model not loaded properly.")
-                return redirect("dashboard")
-
             # Wrap uploaded file in BytesIO
             img_bytes = BytesIO(image_file.read())
-            img = image.load_img(img_bytes, target_size=(28, 28))
-            img_array = image.img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            # img_array = img_array / 255.0  # Rescale to [0, 1] as done in training
+            img_array = np.expand_dims(preprocess_image(img_bytes), axis=0)
 
-            predictions = model.predict(img_array)
+            try:
+                predictions, embeddings = run_model(img_array)
+            except InferenceUnavailable as e:
+                print(f"Inference error: {e}")
+                messages.error(request, "Model not loaded properly.")
+                return redirect("dashboard")
             predicted_index = np.argmax(predictions[0])
             print(predictions)
             result = class_names[predicted_index]
@@ -71,7 +66,7 @@ def upload_skin_view(request):
             risk_level = risk_map.get(result, "Unknown Risk")
  
             # Save prediction
-            Prediction.objects.create(
+            scan = Prediction.objects.create(
                 user=request.user,
                 patient_name=patient_name,
                 scan_type=scan_type,
@@ -81,6 +76,18 @@ def upload_skin_view(request):
                 image_file=image_file
             )
 
+            # The scan is saved; a derived file failing must not turn it into a 500
+            try:
+                make_thumbnail(scan, img_bytes.getvalue())
+            except Exception as e:
+                print(f"Error creating thumbnail: {e}")
+
+            if embeddings is not None:
+                try:
+                    EmbeddingStore().add([scan.id], embeddings)
+                except Exception as e:
+                    print(f"Error storing embedding: {e}")
+
             # Return JSON if AJAX
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                 return JsonResponse({